@@ -8,13 +8,8 @@ genmsg.base.log_verbose('GENMSG_VERBOSE' in os.environ)
 sys.path.insert(0, genmsg_python_path)
 import genmsg.deps
 
-msg_deps = {}
-for m in messages:
-  msg_deps[m] = genmsg.deps.find_msg_dependencies(pkg_name, m, dep_search_paths)
-
-srv_deps = {}
-for s in services:
-  srv_deps[s] = genmsg.deps.find_srv_dependencies(pkg_name, s, dep_search_paths)
+# resolve all dependencies of the package in one pass
+pkg_deps = genmsg.deps.find_package_dependencies(pkg_name, messages, services, dep_search_paths)
 
 }@
 message(STATUS "@(pkg_name): @(len(messages)) messages")
@@ -40,7 +35,7 @@ set (ALL_GEN_OUTPUT_FILES_cpp "")
 _generate_msg_@(l[3:])(@pkg_name
   @m
   "${MSG_I_FLAGS}"
-  "@(';'.join(msg_deps[m]))"
+  "@(';'.join(pkg_deps[m]))"
   ${CMAKE_BINARY_DIR}/gen/@(l[3:])/@pkg_name
 )
 @[end for]@
@@ -50,7 +45,7 @@ _generate_msg_@(l[3:])(@pkg_name
 _generate_srv_@(l[3:])(@pkg_name
   @s
   "${MSG_I_FLAGS}"
-  "@(';'.join(srv_deps[s]))"
+  "@(';'.join(pkg_deps[s]))"
   ${CMAKE_BINARY_DIR}/gen/@(l[3:])/@pkg_name
 )
 @[end for]@
@@ -74,6 +69,9 @@ if(@(l)_INSTALL_DIR)
 install(
   DIRECTORY ${CMAKE_BINARY_DIR}/gen/@(l[3:])/@pkg_name
   DESTINATION ${@(l)_INSTALL_DIR}
+  # build bookkeeping of the generators
+  PATTERN ".genmsg_manifest.json" EXCLUDE
+  PATTERN ".gen*.stamp" EXCLUDE
 )
 endif()
 @[for d in dependencies]@
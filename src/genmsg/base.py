@@ -49,24 +49,60 @@ IODELIM   = '---'
 
 verbose = False
 
-import inspect, pprint
+import pprint
 
 def log_verbose(value):
     global verbose
     verbose = value
 
+# log() is called on hot paths: callers pass the parts of the message,
+# which are only converted to strings if verbose is enabled
+
+def _caller():
+    # much cheaper than inspect.stack(), which reads source of the whole stack
+    frame = sys._getframe(2)
+    return "%s:%d" % (frame.f_code.co_filename, frame.f_lineno)
+
 def log(*args):
-    global verbose
     if verbose:
-        print("%s:%d" % inspect.stack()[1][1:3], file=sys.stderr)
+        print(_caller(), file=sys.stderr)
         print(' '.join([str(x) for x in args]), file=sys.stderr)
 
 def plog(msg, obj):
     if verbose:
-        print("%s:%d" % inspect.stack()[1][1:3], file=sys.stderr)
+        print(_caller(), file=sys.stderr)
         print(msg, " ", file=sys.stderr)
         pprint.pprint(obj, file=sys.stderr)
 
+def memoize(maxsize=1024):
+    """
+    Decorator caching the results of a function of hashable
+    positional arguments in a bounded cache.  This is :func:`functools.lru_cache`
+    where available.  Otherwise the cache is simply emptied once it
+    holds *maxsize* results, which is nearly as effective for the few
+    hundred distinct names of a workspace and much cheaper per hit than
+    a pure Python LRU.
+    """
+    try:
+        from functools import lru_cache
+        return lru_cache(maxsize)
+    except ImportError:
+        pass
+    def decorator(func):
+        cache = {}
+        def wrapper(*args):
+            try:
+                return cache[args]
+            except KeyError:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                value = cache[args] = func(*args)
+                return value
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
 class InvalidMsgSpec(Exception):
     pass
 
@@ -7,43 +7,70 @@ import genmsg
 # msg_file - string full path
 # search_paths -  dict of {'pkg':'msg_dir'}
 def find_msg_dependencies(pkg_name, msg_file, search_paths):
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+    return _find_msg_dependencies(msg_context, pkg_name, msg_file, search_paths)
 
-    # Read and parse the source msg file                                                                                                     
-    msg_context = genmsg.msg_loader.MsgContext.create_default() # not used?                                                                  
+def find_srv_dependencies(pkg_name, msg_file, search_paths):
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+    return _find_srv_dependencies(msg_context, pkg_name, msg_file, search_paths)
+
+# msg_files, srv_files - lists of string full paths
+# returns dict of {'file':['dep_file']}
+def find_package_dependencies(pkg_name, msg_files, srv_files, search_paths, jobs=1):
+    # One context is shared by all files, so each dependency is only
+    # read and parsed once for the whole package
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+    search_paths = genmsg.msg_loader.SearchPathIndex(search_paths)
+    deps = {}
+    for msg_file in msg_files:
+        deps[msg_file] = _find_msg_dependencies(msg_context, pkg_name, msg_file, search_paths, jobs)
+    for srv_file in srv_files:
+        deps[srv_file] = _find_srv_dependencies(msg_context, pkg_name, srv_file, search_paths, jobs)
+    return deps
+
+def _find_msg_dependencies(msg_context, pkg_name, msg_file, search_paths, jobs=1):
+
+    # Read and parse the source msg file
     full_type_name = genmsg.gentools.compute_full_type_name(pkg_name, os.path.basename(msg_file))
-    spec = genmsg.msg_loader.load_msg_from_file(msg_context, msg_file, full_type_name)
+    loaded_file = msg_context.get_file(full_type_name)
+    if loaded_file and os.path.abspath(loaded_file) == os.path.abspath(msg_file):
+        # already loaded as a dependency of another file of the package,
+        # parsing it again would replace the spec and drop cached md5sums
+        spec = msg_context.get_or_load(full_type_name, genmsg.msg_loader.load_msg_from_file, msg_context, msg_file, full_type_name)
+    else:
+        spec = genmsg.msg_loader.load_msg_from_file(msg_context, msg_file, full_type_name)
+        # record the file so that other files of a package sharing msg_context can depend on it
+        msg_context.set_file(full_type_name, msg_file)
 
     try:
-        genmsg.msg_loader.load_depends(msg_context, spec, search_paths)
+        genmsg.msg_loader.load_depends(msg_context, spec, search_paths, jobs)
     except genmsg.InvalidMsgSpec as e:
         raise genmsg.MsgGenerationException("Cannot read .msg for %s: %s"%(full_type_name, str(e)))
 
     deps = set()
-    for dep_type_name in msg_context.get_all_depends(full_type_name):
+    for dep_type_name in msg_context.get_depends_closure(full_type_name):
         deps.add( msg_context.get_file(dep_type_name) )
 
     return list(deps)
 
+def _find_srv_dependencies(msg_context, pkg_name, msg_file, search_paths, jobs=1):
 
-def find_srv_dependencies(pkg_name, msg_file, search_paths):
-
-    # Read and parse the source msg file                                                                                        
-    msg_context = genmsg.msg_loader.MsgContext.create_default() # not used?                                                      
+    # Read and parse the source srv file
     full_type_name = genmsg.gentools.compute_full_type_name(pkg_name, os.path.basename(msg_file))
 
     spec = genmsg.msg_loader.load_srv_from_file(msg_context, msg_file, full_type_name)
 
     try:
-        genmsg.msg_loader.load_depends(msg_context, spec, search_paths)
+        genmsg.msg_loader.load_depends(msg_context, spec, search_paths, jobs)
     except genmsg.InvalidMsgSpec as e:
         raise genmsg.MsgGenerationException("Cannot read .msg for %s: %s"%(full_type_name, str(e)))
 
     deps = set()
 
-    for dep_type_name in msg_context.get_all_depends(spec.request.full_name):
+    for dep_type_name in msg_context.get_depends_closure(spec.request.full_name):
         deps.add( msg_context.get_file(dep_type_name) )
 
-    for dep_type_name in msg_context.get_all_depends(spec.response.full_name):
+    for dep_type_name in msg_context.get_depends_closure(spec.response.full_name):
         deps.add( msg_context.get_file(dep_type_name) )
 
     return list(deps)
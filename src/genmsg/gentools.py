@@ -43,19 +43,60 @@ md5sums and message definitions of classes.
 import sys
 import hashlib
 
-try:
-    from cStringIO import StringIO # Python 2.x
-except ImportError:
-    from io import StringIO # Python 3.x
-
 from . import msgs
 
 from .msgs import InvalidMsgSpec, MsgSpec, bare_msg_type, is_builtin
 from .msg_loader import load_depends
 from .srvs import SrvSpec
-from . import names
 from . import base
 
+def _md5_lines(msg_context, spec):
+    """
+    :returns: iterator over the lines of the md5 text of *spec* before
+      stripping, see :func:`compute_md5_text`
+    """
+    for c in spec.constants:
+        yield "%s %s=%s"%(c.type, c.name, c.val_text)
+    for type_, name in zip(spec.types, spec.names):
+        msg_type = bare_msg_type(type_)
+        # md5 spec strips package names
+        if is_builtin(msg_type):
+            yield "%s %s"%(type_, name)
+        else:
+            # embedded types are represented by their md5sum, which
+            # compute_md5() caches on msg_context
+            sub_spec = msg_context.get_registered(msg_type)
+            yield "%s %s"%(compute_md5(msg_context, sub_spec), name)
+
+def _strip_lines(lines):
+    """
+    Same as ``'\n'.join(lines).strip().split('\n')`` without joining
+    the lines: leading and trailing blank lines are dropped and the
+    first and last lines stripped.
+
+    :param lines: iterable of lines without newlines
+    :returns: iterator over the stripped lines
+    """
+    # last non-blank line and the blank lines after it are held back
+    # until it is known whether more non-blank lines follow
+    last = None
+    blank = []
+    for line in lines:
+        if not line.strip():
+            if last is not None:
+                blank.append(line)
+            continue
+        if last is None:
+            line = line.lstrip()
+        else:
+            yield last
+            for b in blank:
+                yield b
+            del blank[:]
+        last = line
+    if last is not None:
+        yield last.rstrip()
+
 def compute_md5_text(msg_context, spec):
     """
     Compute the text used for md5 calculation. MD5 spec states that we
@@ -66,28 +107,19 @@ def compute_md5_text(msg_context, spec):
 
     :returns: text for ROS MD5-processing, ``str``
     """
-    package = spec.package
-
-    buff = StringIO()    
+    return '\n'.join(_strip_lines(_md5_lines(msg_context, spec)))
 
-    for c in spec.constants:
-        buff.write("%s %s=%s\n"%(c.type, c.name, c.val_text))
-    for type_, name in zip(spec.types, spec.names):
-        msg_type = bare_msg_type(type_)
-        # md5 spec strips package names
-        if is_builtin(msg_type):
-            buff.write("%s %s\n"%(type_, name))
-        else:
-            # recursively generate md5 for subtype.  have to build up
-            # dependency representation for subtype in order to
-            # generate md5
-            sub_pkg, _ = names.package_resource_name(msg_type)
-            sub_pkg = sub_pkg or package
-            sub_spec = msg_context.get_registered(msg_type)
-            sub_md5 = compute_md5(msg_context, sub_spec)
-            buff.write("%s %s\n"%(sub_md5, name))
-    
-    return buff.getvalue().strip() # remove trailing new line
+def _update_hash(msg_context, spec, hash):
+    """
+    Feed the md5 text of *spec* to *hash* as UTF-8, one line at a
+    time.  The text is never joined, only the current line is held.
+    """
+    newline = False
+    for line in _strip_lines(_md5_lines(msg_context, spec)):
+        if newline:
+            hash.update(b'\n')
+        hash.update(line if isinstance(line, bytes) else line.encode('utf-8'))
+        newline = True
 
 def _compute_hash(msg_context, spec, hash):
     """
@@ -100,10 +132,10 @@ def _compute_hash(msg_context, spec, hash):
     # accumulate the hash
     # - root file
     if isinstance(spec, MsgSpec):
-        hash.update(compute_md5_text(msg_context, spec))
+        _update_hash(msg_context, spec, hash)
     elif isinstance(spec, SrvSpec):
-        hash.update(compute_md5_text(msg_context, spec.request))
-        hash.update(compute_md5_text(msg_context, spec.response))        
+        _update_hash(msg_context, spec.request, hash)
+        _update_hash(msg_context, spec.response, hash)
     else:
         raise Exception("[%s] is not a message or service"%spec)   
     return hash.hexdigest()
@@ -116,18 +148,75 @@ def compute_md5(msg_context, spec):
     :param spec: :class:`MsgSpec` to compute md5 for.
     :returns: md5 hash, ``str``
     """
-    return _compute_hash(msg_context, spec, hashlib.md5())
+    # md5sums of registered messages are cached on the context as
+    # shared types (e.g. std_msgs/Header) are embedded many times over
+    cacheable = isinstance(spec, MsgSpec) and msg_context.is_registered(spec.full_name) and \
+        msg_context.get_registered(spec.full_name) is spec
+    if cacheable:
+        md5sum = msg_context.get_md5(spec.full_name)
+        if md5sum is not None:
+            return md5sum
+    md5sum = _compute_hash(msg_context, spec, hashlib.md5())
+    if cacheable:
+        msg_context.set_md5(spec.full_name, md5sum, spec)
+    return md5sum
 
 ## alias
 compute_md5_v2 = compute_md5
 
-def _unique_deps(dep_list):
-    uniques = []
-    for d in dep_list:
-        if d not in uniques:
-            uniques.append(d)
-    return uniques
-        
+def _embedded_types(spec):
+    """
+    :returns: iterator over the non-builtin types of the fields of *spec*
+    """
+    for type_ in spec.types:
+        msg_type = bare_msg_type(type_)
+        if not is_builtin(msg_type):
+            yield msg_type
+
+def compute_md5_all(msg_context, srv_specs=()):
+    """
+    Compute md5 hashes of all types registered in *msg_context*.
+    Types are hashed in topological order, embedded types first, so
+    each type is hashed exactly once from the cached md5sums of the
+    types it embeds.
+
+    :param msg_context: :class:`MsgContext` instance with all types
+      to compute md5s for loaded.
+    :param srv_specs: :class:`SrvSpec` instances to compute md5s for.
+      Services are not registered in *msg_context*, only their
+      request and response messages are.
+    :returns: dictionary mapping full type names to md5sums, ``{str: str}``
+    :raises: :exc:`KeyError` If an embedded type is not registered
+    :raises: :exc:`InvalidMsgSpec` If types embed each other
+    """
+    md5s = {}
+    for root in sorted(msg_context.get_registered_types()):
+        if root in md5s:
+            continue
+        # depth-first traversal with an explicit stack of (type,
+        # iterator over embedded types), a type is hashed once all
+        # types it embeds are
+        stack = [(root, _embedded_types(msg_context.get_registered(root)))]
+        path = [root]
+        while stack:
+            full_msg_type, embedded = stack[-1]
+            for msg_type in embedded:
+                if msg_type in md5s:
+                    continue
+                if msg_type in path:
+                    cycle = path[path.index(msg_type):] + [msg_type]
+                    raise InvalidMsgSpec("circular dependency: %s"%(' -> '.join(cycle)))
+                stack.append((msg_type, _embedded_types(msg_context.get_registered(msg_type))))
+                path.append(msg_type)
+                break
+            else:
+                stack.pop()
+                path.pop()
+                md5s[full_msg_type] = compute_md5(msg_context, msg_context.get_registered(full_msg_type))
+    for spec in srv_specs:
+        md5s[spec.full_name] = compute_md5(msg_context, spec)
+    return md5s
+
 def compute_full_text(msg_context, spec):
     """
     Compute full text of message/service, including text of embedded
@@ -140,20 +229,18 @@ def compute_full_text(msg_context, spec):
     :param spec: :class:`MsgSpec` to compute full text for.
     :returns: concatenated text for msg/srv file and embedded msg/srv types, ``str``
     """
-    buff = StringIO()
-    sep = '='*80+'\n'
-
-    # write the text of the top-level type
-    buff.write(spec.text)
-    buff.write('\n')    
-    # append the text of the dependencies (embedded types).  Can't use set() as we have to preserve order.
-    for d in _unique_deps(msg_context.get_all_depends(spec.full_name)):
-        buff.write(sep)
-        buff.write("MSG: %s\n"%d)
-        buff.write(msg_context.get_registered(d).text)
-        buff.write('\n')
-    # #1168: remove the trailing \n separator that is added by the concatenation logic
-    return buff.getvalue()[:-1]
+    # the text of the top-level type followed by the text of the
+    # dependencies (embedded types).  The blocks of the dependencies
+    # are cached on the context as they are shared by many types.
+    blocks = [spec.text]
+    for d in msg_context.get_depends_closure(spec.full_name):
+        block = msg_context.get_text_block(d)
+        if block is None:
+            d_spec = msg_context.get_registered(d)
+            block = "%s\nMSG: %s\n%s"%('='*80, d, d_spec.text)
+            msg_context.set_text_block(d, block, d_spec)
+        blocks.append(block)
+    return '\n'.join(blocks)
 
 def compute_full_type_name(package_name, file_name):
     """
@@ -39,12 +39,36 @@ Implements: U{http://ros.org/wiki/msg}
 """
 
 import os
+import re
 import sys
 
-from . base import InvalidMsgSpec, EXT_MSG, MSG_DIR, SEP, log
+from . base import InvalidMsgSpec, EXT_MSG, MSG_DIR, SEP, log, memoize
 from . names import is_legal_resource_name, is_legal_resource_base_name, package_resource_name, resource_name
 
-#TODOXXX: unit test
+try:
+    _intern = intern
+except NameError:
+    _intern = sys.intern #py3k
+
+def intern_str(s):
+    """
+    Intern *s* so that equal type and field names across all loaded
+    specs share a single string.  Strings that cannot be interned
+    (e.g. ``unicode`` on Python 2) are returned unchanged.
+
+    :param s: string to intern, ``str``
+    :returns: interned string, ``str``
+    """
+    try:
+        return _intern(s)
+    except TypeError:
+        return s
+
+# bare types, resolved types and type descriptors are memoized.  Real
+# workspaces only use a few hundred distinct type strings, so each is
+# usually parsed once per process.
+
+@memoize()
 def bare_msg_type(msg_type):
     """
     Compute the bare data type, e.g. for arrays, get the underlying array item type
@@ -55,9 +79,10 @@ def bare_msg_type(msg_type):
     if msg_type is None:
         return None
     if '[' in msg_type:
-        return msg_type[:msg_type.find('[')]
-    return msg_type
+        return intern_str(msg_type[:msg_type.find('[')])
+    return intern_str(msg_type)
 
+@memoize(4096)
 def resolve_type(msg_type, package_context):
     """
     Resolve type name based on current package context.
@@ -75,13 +100,14 @@ def resolve_type(msg_type, package_context):
     """
     bt = bare_msg_type(msg_type)
     if bt in BUILTIN_TYPES:
-        return msg_type
+        resolved = msg_type
     elif bt == HEADER:
-        return HEADER_FULL_NAME
+        resolved = HEADER_FULL_NAME
     elif SEP in msg_type:
-        return msg_type
+        resolved = msg_type
     else:
-        return "%s%s%s"%(package_context, SEP, msg_type)    
+        resolved = "%s%s%s"%(package_context, SEP, msg_type)
+    return intern_str(resolved)
 
 #NOTE: this assumes that we aren't going to support multi-dimensional
 
@@ -92,6 +118,9 @@ def parse_type(msg_type):
     :returns: base_type, is_array, array_length, ``(str, bool, int)``
     :raises: :exc:`ValueError` If *msg_type* cannot be parsed
     """
+    return type_descriptor(msg_type)[:3]
+
+def _parse_type(msg_type):
     if not msg_type:
         raise ValueError("Invalid empty type")
     if '[' in msg_type:
@@ -109,10 +138,45 @@ def parse_type(msg_type):
                 raise ValueError("Invalid array dimension: [%s]"%splits[1][:-1])
     else:
         return msg_type, False, None
+
+class TypeDescriptor(tuple):
+    """
+    Immutable parsed form of a field type string, as returned by
+    :func:`type_descriptor`:
+    ``(base_type, is_array, array_len, is_builtin, is_header)``
+    """
+    __slots__ = ()
+
+    base_type = property(lambda self: self[0])
+    is_array = property(lambda self: self[1])
+    array_len = property(lambda self: self[2])
+    is_builtin = property(lambda self: self[3])
+    is_header = property(lambda self: self[4])
+
+@memoize()
+def type_descriptor(msg_type):
+    """
+    Parse ROS message field type, caching the result.  While cached,
+    the same :class:`TypeDescriptor` instance is returned for every
+    call with an equal *msg_type*.
+
+    :param msg_type: ROS field type, ``str``
+    :returns: :class:`TypeDescriptor`
+    :raises: :exc:`ValueError` If *msg_type* cannot be parsed
+    """
+    base_type, is_array, array_len = _parse_type(msg_type)
+    base_type = intern_str(base_type)
+    return TypeDescriptor((base_type, is_array, array_len,
+                           is_builtin(base_type), is_header_type(msg_type)))
    
 ################################################################################
 # name validation 
 
+# array suffixes, any number of [] or [N].  Unicode, as int() accepts
+# any decimal digit.
+_ARRAY_SUFFIXES_P = re.compile(r'(?:\[\d*\])*\Z', re.UNICODE)
+
+@memoize()
 def is_valid_msg_type(x):
     """
     :returns: True if the name is a syntatically legal message type name, ``bool``
@@ -123,23 +187,7 @@ def is_valid_msg_type(x):
     if not is_legal_resource_name(base):
         return False
     #parse array indicies
-    x = x[len(base):]
-    state = 0
-    i = 0
-    for c in x:
-        if state == 0:
-            if c != '[':
-                return False
-            state = 1 #open
-        elif state == 1:
-            if c == ']':
-                state = 0 #closed
-            else:
-                try:
-                    int(c)
-                except:
-                    return False
-    return state == 0
+    return _ARRAY_SUFFIXES_P.match(x, len(base)) is not None
 
 def is_valid_constant_type(x):
     """
@@ -199,13 +247,13 @@ class Field(object):
     is_builtin
     is_header
     """
+    __slots__ = ['name', 'type', 'base_type', 'is_array', 'array_len', 'is_builtin', 'is_header']
     
     def __init__(self, name, type):
         self.name = name
         self.type = type
-        (self.base_type, self.is_array, self.array_len) = parse_type(type)
-        self.is_header = is_header_type(self.type)
-        self.is_builtin = is_builtin(self.base_type)
+        (self.base_type, self.is_array, self.array_len,
+         self.is_builtin, self.is_header) = type_descriptor(type)
 
     def __eq__(self, other):
         if not isinstance(other, Field):
@@ -223,6 +271,8 @@ class MsgSpec(object):
     types and names are stored in separate lists with 1-to-1
     correspondence. MsgSpec can also return an md5 of the source text.
     """
+    __slots__ = ['types', 'names', 'constants', 'header_present', 'text',
+                 'full_name', 'short_name', 'package', '_parsed_fields']
 
     def __init__(self, types, names, constants, text, full_name, package = '', short_name = ''):
         """
@@ -238,10 +288,10 @@ class MsgSpec(object):
         if not short_name:
             short_name = alt_short_name
             
-        self.types = types
+        self.types = [intern_str(t) for t in types]
         if len(set(names)) != len(names):
             raise InvalidMsgSpec("Duplicate field names in message: %s"%names)
-        self.names = names
+        self.names = [intern_str(n) for n in names]
         self.constants = constants
         assert len(self.types) == len(self.names), "len(%s) != len(%s)"%(self.types, self.names)
         #Header.msg support
@@ -253,10 +303,14 @@ class MsgSpec(object):
         self.full_name = full_name
         self.short_name = short_name
         self.package = package
+        # validate field types now, Field instances are created on
+        # first use of parsed_fields()
         try:
-            self._parsed_fields = [Field(name, type) for (name, type) in zip(self.names, self.types)]
+            for type in self.types:
+                type_descriptor(type)
         except ValueError as e:
             raise InvalidMsgSpec("invalid field: %s"%(e))
+        self._parsed_fields = None
         
     def fields(self):
         """
@@ -268,6 +322,8 @@ class MsgSpec(object):
         """
         :returns: list of :class:`Field` classes, ``[Field,]``
         """
+        if self._parsed_fields is None:
+            self._parsed_fields = [Field(name, type) for (name, type) in zip(self.names, self.types)]
         return self._parsed_fields
 
     def has_header(self):
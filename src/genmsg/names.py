@@ -34,6 +34,8 @@ PRN_SEPARATOR = '/'
 
 import re
 
+from . base import memoize
+
 def normalize_package_context(package_context):
     package_context = package_context.strip()
     while package_context.endswith(PRN_SEPARATOR):
@@ -114,6 +116,9 @@ def package_resource_name(name):
 
 #ascii char followed by (alphanumeric, _, /)
 RESOURCE_NAME_LEGAL_CHARS_P = re.compile('^[A-Za-z][\w_\/]*$') 
+# same, matching the whole name
+_RESOURCE_NAME_P = re.compile('^[A-Za-z][\w_\/]*\\Z')
+@memoize()
 def is_legal_resource_name(name):
     """
     Check if name is a legal ROS name for filesystem resources
@@ -127,11 +132,12 @@ def is_legal_resource_name(name):
     # resource names can be unicode due to filesystem
     if name is None:
         return False
-    m = RESOURCE_NAME_LEGAL_CHARS_P.match(name)
     # '//' check makes sure there isn't double-slashes
-    return m is not None and m.group(0) == name and not '//' in name
+    return _RESOURCE_NAME_P.match(name) is not None and not '//' in name
 
 BASE_RESOURCE_NAME_LEGAL_CHARS_P = re.compile('^[A-Za-z][\w_]*$') #ascii char followed by (alphanumeric, _)
+_BASE_RESOURCE_NAME_P = re.compile('^[A-Za-z][\w_]*\\Z')
+@memoize()
 def is_legal_resource_base_name(name):
     """
     Validates that name is a legal resource base name. A base name has
@@ -140,6 +146,5 @@ def is_legal_resource_base_name(name):
     # resource names can be unicode due to filesystem
     if name is None:
         return False
-    m = BASE_RESOURCE_NAME_LEGAL_CHARS_P.match(name)
-    return m is not None and m.group(0) == name
+    return _BASE_RESOURCE_NAME_P.match(name) is not None
 
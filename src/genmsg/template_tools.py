@@ -34,17 +34,118 @@
 ## 
 ## 
 
+from __future__ import print_function
+
 import sys
 import os
+import hashlib
+import json
+import multiprocessing
 import em
 import genmsg.command_line
 import genmsg.msgs
 
+try:
+    from cStringIO import StringIO # Python 2.x
+except ImportError:
+    from io import StringIO # Python 3.x
+
+## name of the manifest recording what was generated into an output directory
+MANIFEST_FILE = '.genmsg_manifest.json'
+
+# template file path -> template text, templates are only read once per process
+_templates = {}
+# interpreter reused for all templates rendered by this process
+_interpreter = None
+
+def _load_template(template_dir, template_file_name):
+    template_file = os.path.join(template_dir, template_file_name)
+    try:
+        return _templates[template_file]
+    except KeyError:
+        pass
+    if not os.path.isfile(template_file):
+        raise RuntimeError("Template file %s not found in template dir %s" % (template_file_name, template_dir))
+    with open(template_file) as f:
+        template = f.read()
+    # like em.Interpreter.file(), turn a bangpath into an empy comment
+    if template.startswith(em.BANGPATH):
+        template = em.DEFAULT_PREFIX + '#' + template[2:]
+    _templates[template_file] = template
+    return template
+
+def _get_interpreter():
+    """
+    :returns: interpreter shared by all templates rendered by this
+      process, created on first use, ``em.Interpreter``
+    """
+    global _interpreter
+    if _interpreter is not None and hasattr(sys.stdout, '_testProxy'):
+        return _interpreter
+    # EmPy installs a proxy as sys.stdout once per process and refuses
+    # to create or run interpreters if the proxy is gone.  Test runners
+    # capturing output replace sys.stdout, in that case the proxy is
+    # installed again and the interpreter re-created.
+    if not hasattr(sys.stdout, '_testProxy') and em.Interpreter._wasProxyInstalled:
+        sys.stdout = em.ProxyFile(sys.stdout)
+    if _interpreter is not None:
+        _interpreter.shutdown()
+    _interpreter = em.Interpreter(output=StringIO(), options={em.RAW_OPT:True,em.BUFFERED_OPT:True})
+    return _interpreter
+
+def _render(template_dir, template_file_name, g):
+    """
+    Expand template with a fresh copy of globals *g*.
+
+    :returns: expanded template, ``str``
+    """
+    template = _load_template(template_dir, template_file_name)
+    interpreter = _get_interpreter()
+    # reset output and globals of the interpreter
+    output = StringIO()
+    interpreter.output = output
+    interpreter.reset()
+    interpreter.setGlobals(dict(g))
+    interpreter.string(template, os.path.join(template_dir, template_file_name))
+    interpreter.stream().undivertAll(True)
+    interpreter.flush()
+    return output.getvalue()
+
+def _write_if_changed(output_file, text):
+    """
+    Write *text* to *output_file* unless the file already has exactly
+    that content.  Leaving unchanged files untouched keeps their mtime,
+    so that code depending on them is not rebuilt.  The file is
+    replaced atomically.
+
+    :returns: ``True`` if *output_file* was written, ``bool``
+    """
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    try:
+        if os.path.getsize(output_file) == len(text):
+            with open(output_file, 'rb') as f:
+                if f.read() == text:
+                    return False
+    except (IOError, OSError):
+        pass # does not exist yet
+    tmp_file = "%s.%d.tmp"%(output_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(text)
+    os.rename(tmp_file, output_file)
+    return True
+
 # generate msg or srv files from a template file
 # template_map of the form { 'template_file':'output_file'} output_file can contail @NAME@ which will be replaced by the message/service name
-def _generate_from_spec(input_file, output_dir, template_dir, msg_context, spec, template_map):
-
+# returns the job to pass to _run_spec_job(). Everything depending on
+# msg_context is computed here so that jobs can be run in another process.
+def _spec_job(input_file, output_dir, template_dir, msg_context, spec, template_map):
     md5sum = genmsg.compute_md5(msg_context, spec)
+    return (input_file, output_dir, template_dir, spec, md5sum, template_map)
+
+# returns (written, unchanged) counts of output files
+def _run_spec_job(job):
+    input_file, output_dir, template_dir, spec, md5sum, template_map = job
 
     # Set dictionary for the generator intepreter
     g = { "file_name_in":input_file,
@@ -52,69 +153,129 @@ def _generate_from_spec(input_file, output_dir, template_dir, msg_context, spec,
           "md5sum":md5sum}
 
     # Loop over all files to generate
+    written = unchanged = 0
     for template_file_name, output_file_name in template_map.items():
-        template_file = os.path.join(template_dir, template_file_name)
         output_file = os.path.join(output_dir, output_file_name.replace("@NAME@", spec.short_name))
 
         #print "generate_from_template %s %s %s" % (input_file, template_file, output_file) 
 
-        ofile = open(output_file, 'w') #todo try
-        
-        # todo, reuse interpreter
-        interpreter = em.Interpreter(output=ofile, globals=g, options={em.RAW_OPT:True,em.BUFFERED_OPT:True})
-        if not os.path.isfile(template_file):
-            raise RuntimeError, "Template file %s not found in template dir %s" % (template_file_name, template_dir)
-        interpreter.file(open(template_file)) #todo try
-        interpreter.shutdown()
+        if _write_if_changed(output_file, _render(template_dir, template_file_name, g)):
+            written += 1
+        else:
+            unchanged += 1
+    return written, unchanged
 
-def _generate_msg_from_file(input_file, output_dir, template_dir, search_path, package_name, msg_template_dict):
+def _msg_jobs_from_file(msg_context, input_file, output_dir, template_dir, search_path, package_name, msg_template_dict):
     # Read MsgSpec from .msg file
-    msg_context = genmsg.msg_loader.MsgContext.create_default()
     full_type_name = genmsg.gentools.compute_full_type_name(package_name, os.path.basename(input_file))
-    spec = genmsg.msg_loader.load_msg_from_file(msg_context, input_file, full_type_name)
+    loaded_file = msg_context.get_file(full_type_name)
+    if loaded_file and os.path.abspath(loaded_file) == input_file:
+        # already loaded as a dependency of an earlier input file, parsing
+        # it again would replace the spec and drop cached md5sums
+        spec = msg_context.get_or_load(full_type_name, genmsg.msg_loader.load_msg_from_file, msg_context, input_file, full_type_name)
+    else:
+        spec = genmsg.msg_loader.load_msg_from_file(msg_context, input_file, full_type_name)
+        msg_context.set_file(full_type_name, input_file)
     # Load the dependencies
     genmsg.msg_loader.load_depends(msg_context, spec, search_path)
     # Generate the language dependent msg file
-    _generate_from_spec(input_file,
-                            output_dir,
-                            template_dir,
-                            msg_context,
-                            spec,
-                            msg_template_dict)
-
-def _generate_srv_from_file(input_file, output_dir, template_dir, search_path, package_name, srv_template_dict, msg_template_dict):
+    return [_spec_job(input_file, output_dir, template_dir, msg_context, spec, msg_template_dict)]
+
+def _srv_jobs_from_file(msg_context, input_file, output_dir, template_dir, search_path, package_name, srv_template_dict, msg_template_dict):
     # Read MsgSpec from .srv.file
-    msg_context = genmsg.msg_loader.MsgContext.create_default()
     full_type_name = genmsg.gentools.compute_full_type_name(package_name, os.path.basename(input_file))
     spec = genmsg.msg_loader.load_srv_from_file(msg_context, input_file, full_type_name)        
     # Load the dependencies
     genmsg.msg_loader.load_depends(msg_context, spec, search_path)
-    # Generate the language dependent srv file
-    _generate_from_spec(input_file,
-                            output_dir,
-                            template_dir,
-                            msg_context,
-                            spec,
-                            srv_template_dict)
-    # Generate the language dependent msg file for the srv request
-    _generate_from_spec(input_file,
-                            output_dir,
-                            template_dir,
-                            msg_context,
-                            spec.request,
-                            msg_template_dict)
-    # Generate the language dependent msg file for the srv response
-    _generate_from_spec(input_file,
-                            output_dir,
-                            template_dir,
-                            msg_context,
-                            spec.response,
-                            msg_template_dict)
+    # Generate the language dependent srv file, and the language
+    # dependent msg files for the srv request and response
+    return [_spec_job(input_file, output_dir, template_dir, msg_context, spec, srv_template_dict),
+            _spec_job(input_file, output_dir, template_dir, msg_context, spec.request, msg_template_dict),
+            _spec_job(input_file, output_dir, template_dir, msg_context, spec.response, msg_template_dict)]
+
+def _md5_hexdigest(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+def _load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _file_stamps(files):
+    stamps = {}
+    for f in files:
+        st = os.stat(f)
+        stamps[f] = [st.st_mtime, st.st_size]
+    return stamps
+
+def _output_files(input_file, msg_template_dict, srv_template_dict):
+    """
+    :returns: sorted names of the files the current template maps
+      generate for *input_file*, ``[str]``
+    """
+    short_name = os.path.splitext(os.path.basename(input_file))[0]
+    if input_file.endswith(".srv"):
+        names = [(srv_template_dict, short_name),
+                 (msg_template_dict, short_name + "Request"),
+                 (msg_template_dict, short_name + "Response")]
+    else:
+        names = [(msg_template_dict, short_name)]
+    return sorted([output_file_name.replace("@NAME@", name) for template_map, name in names for output_file_name in template_map.values()])
+
+def _is_generated(entry, output_dir):
+    return all([os.path.isfile(os.path.join(output_dir, f)) for f in entry['outputs']])
+
+def _is_unmodified(entry, output_dir):
+    """
+    :returns: ``True`` if neither the input file nor any file it
+      depends on have been touched since *entry* was recorded, ``bool``
+    """
+    try:
+        return _file_stamps(entry['stamps'].keys()) == entry['stamps'] and _is_generated(entry, output_dir)
+    except OSError:
+        return False
+
+def _manifest_entry(msg_context, input_file, config, spec_jobs):
+    """
+    :returns: manifest entry for *input_file*: its fingerprint, which
+      changes if any md5sum or message text that the generated files
+      depend on changes, stamps of the files it was loaded from and
+      names of the generated files, ``dict``
+    """
+    fingerprint = []
+    dep_files = set([input_file])
+    outputs = []
+    for _, _, _, spec, md5sum, template_map in spec_jobs:
+        if isinstance(spec, genmsg.msgs.MsgSpec):
+            fingerprint.append("%s %s"%(md5sum, _md5_hexdigest(genmsg.compute_full_text(msg_context, spec))))
+            dep_files.update([msg_context.get_file(d) for d in msg_context.get_depends_closure(spec.full_name) if msg_context.get_file(d)])
+        else:
+            fingerprint.append("%s %s"%(md5sum, _md5_hexdigest(spec.text)))
+        outputs.extend([output_file_name.replace("@NAME@", spec.short_name) for output_file_name in template_map.values()])
+    return dict(config=config,
+                fingerprint=_md5_hexdigest('\n'.join(fingerprint)),
+                stamps=_file_stamps(dep_files),
+                outputs=sorted(outputs))
 
 # uniform interface for genering either srv or msg files
 def generate_from_file(input_file, package_name, output_dir, template_dir, include_path, msg_template_dict, srv_template_dict):
+    generate_from_files([input_file], package_name, output_dir, template_dir, include_path, msg_template_dict, srv_template_dict)
+
+# generate many srv and/or msg files of a package in one process. The
+# MsgContext is shared, so common dependencies are only loaded once.
+# With jobs > 1 templates are expanded by a pool of that many processes.
+# With incremental, a manifest in output_dir records the fingerprints of
+# the generated files and input files whose fingerprint did not change
+# since the last run are skipped.
+# the generator script, if given, is part of what the manifest records.
+# returns (written, unchanged) counts of output files
+def generate_from_files(input_files, package_name, output_dir, template_dir, include_path, msg_template_dict, srv_template_dict, jobs=1, incremental=False, generator=None):
     # Normalize paths
-    input_file = os.path.abspath(input_file)
+    input_files = [os.path.abspath(input_file) for input_file in input_files]
     output_dir = os.path.abspath(output_dir)
 
     # Create output dir
@@ -129,42 +290,94 @@ def generate_from_file(input_file, package_name, output_dir, template_dir, inclu
         search_path = genmsg.command_line.includepath_to_dict(include_path)
     else:
         search_path = {}
+    # each package directory is only scanned once
+    search_path = genmsg.msg_loader.SearchPathIndex(search_path)
+
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+
+    if incremental:
+        manifest = _load_manifest(output_dir)
+        # anything that changes the output of all files
+        config = [package_name, genmsg.__version__] + sorted(["%s:%s"%(k, v) for k, v in search_path.items()])
+        if generator and os.path.isfile(generator):
+            with open(generator, 'rb') as f:
+                config.append("%s %s"%(os.path.abspath(generator), hashlib.md5(f.read()).hexdigest()))
+        for template_map in [msg_template_dict, srv_template_dict]:
+            for template_file_name, output_file_name in sorted(template_map.items()):
+                config.append("%s %s %s"%(template_file_name, output_file_name, _md5_hexdigest(_load_template(template_dir, template_file_name))))
+        config = _md5_hexdigest('\n'.join(config))
+    new_manifest = {}
+    unchanged = 0
+
+    # Load all specs and their dependencies
+    spec_jobs = []
+    for input_file in input_files:
+        entry = manifest.get(input_file) if incremental else None
+        if entry and (entry['config'] != config or
+                      entry['outputs'] != _output_files(input_file, msg_template_dict, srv_template_dict)):
+            entry = None
+        if entry and _is_unmodified(entry, output_dir):
+            # no need to even load the file
+            new_manifest[input_file] = entry
+            unchanged += len(entry['outputs'])
+            continue
+
+        if input_file.endswith(".msg"):
+            file_jobs = _msg_jobs_from_file(msg_context, input_file, output_dir, template_dir, search_path, package_name, msg_template_dict)
+        elif input_file.endswith(".srv"):
+            file_jobs = _srv_jobs_from_file(msg_context, input_file, output_dir, template_dir, search_path, package_name, srv_template_dict, msg_template_dict)
+        else:
+            assert False, "Uknown file extension for %s"%input_file
+
+        if incremental:
+            new_entry = _manifest_entry(msg_context, input_file, config, file_jobs)
+            new_manifest[input_file] = new_entry
+            if entry and entry['fingerprint'] == new_entry['fingerprint'] and _is_generated(entry, output_dir):
+                # touched, but nothing the generated files depend on changed
+                unchanged += len(new_entry['outputs'])
+                continue
+        spec_jobs.extend(file_jobs)
 
     # Generate the file(s)
-    if input_file.endswith(".msg"):
-        _generate_msg_from_file(input_file, output_dir, template_dir, search_path, package_name, msg_template_dict)
-    elif input_file.endswith(".srv"):
-        _generate_srv_from_file(input_file, output_dir, template_dir, search_path, package_name, srv_template_dict, msg_template_dict)
+    if jobs > 1 and len(spec_jobs) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(spec_jobs)))
+        try:
+            counts = pool.map(_run_spec_job, spec_jobs)
+        finally:
+            pool.terminate()
+            pool.join()
     else:
-        assert False, "Uknown file extension for %s"%input_file
+        counts = [_run_spec_job(job) for job in spec_jobs]
+
+    if incremental:
+        _write_if_changed(os.path.join(output_dir, MANIFEST_FILE), json.dumps(new_manifest, indent=1, sort_keys=True))
+    return sum([c[0] for c in counts]), unchanged + sum([c[1] for c in counts])
 
+# returns (written, unchanged) counts of output files
 def generate_module(package_name, output_dir, template_dir, template_dict):
-    # Locate generate msg files
-    files = os.listdir(output_dir)
+    # Locate generate msg files.  Build bookkeeping like MANIFEST_FILE
+    # is hidden, generated files never are.
+    files = [f for f in os.listdir(output_dir) if not f.startswith('.')]
 
     # Set dictionary for the generator intepreter
     g = dict(files=files,
              package=package_name)
 
     # Loop over all files to generate
+    written = unchanged = 0
     for template_file_name, output_file_name in template_dict.items():
-        template_file = os.path.join(template_dir, template_file_name)
         output_file = os.path.join(output_dir, output_file_name)
 
-        ofile = open(output_file, 'w') #todo try
-        
-        # todo, reuse interpreter
-        interpreter = em.Interpreter(output=ofile, options={em.RAW_OPT:True,em.BUFFERED_OPT:True})
-        interpreter.updateGlobals(g)
-        if not os.path.isfile(template_file):
-            raise RuntimeError, "Template file %s not found in template dir %s" % (template_file_name, template_dir)
-        interpreter.file(open(template_file)) #todo try
-        interpreter.shutdown()
+        if _write_if_changed(output_file, _render(template_dir, template_file_name, g)):
+            written += 1
+        else:
+            unchanged += 1
+    return written, unchanged
 
 # Uniform interface to support the standard command line options
 def generate_from_command_line_options(argv, msg_template_dict, srv_template_dict, module_template_dict = {}):
     from optparse import OptionParser
-    parser = OptionParser("[options] <srv file>")
+    parser = OptionParser("[options] <msg/srv files>")
     parser.add_option("-p", dest='package',
                       help="ros package the generated msg/srv files belongs to")
     parser.add_option("-o", dest='outdir',
@@ -178,6 +391,12 @@ def generate_from_command_line_options(argv, msg_template_dict, srv_template_dic
     parser.add_option("-e", dest='emdir',
                       help="directory containing template files",
                       default=sys.path[0])
+    parser.add_option("-j", dest='jobs',
+                      help="number of processes generating files in parallel",
+                      type='int', default=1)
+    parser.add_option("--incremental", dest='incremental',
+                      help="only generate files whose inputs changed since the last run",
+                      action='store_true', default=False)
 
     (options, argv) = parser.parse_args(argv)
 
@@ -186,11 +405,13 @@ def generate_from_command_line_options(argv, msg_template_dict, srv_template_dic
         exit(-1)
 
     if( options.module ):
-        generate_module(options.package, options.outdir, options.emdir, module_template_dict)
+        written, unchanged = generate_module(options.package, options.outdir, options.emdir, module_template_dict)
     else:
         if len(argv) > 1:
-            generate_from_file(argv[1], options.package, options.outdir, options.emdir, options.includepath, msg_template_dict, srv_template_dict)
+            written, unchanged = generate_from_files(argv[1:], options.package, options.outdir, options.emdir, options.includepath, msg_template_dict, srv_template_dict, options.jobs, options.incremental, argv[0])
         else:
             parser.print_help()
             exit(-1)
+    if unchanged:
+        print("%s: %d files written, %d unchanged files skipped"%(options.package, written, unchanged))
 
@@ -0,0 +1,247 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Micro benchmarks for genmsg.  Run from the top-level directory::
+
+  PYTHONPATH=src python test/benchmark_genmsg.py [benchmark ...]
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import sys
+import time
+import types
+
+def get_test_dir():
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), 'files'))
+
+def get_msg_files():
+    """
+    :returns: list of (full type name, path) of all valid .msg files in test/files
+    """
+    test_dir = get_test_dir()
+    msg_files = []
+    for pkg in sorted(os.listdir(test_dir)):
+        msg_dir = os.path.join(test_dir, pkg, 'msg')
+        if pkg == 'invalid' or not os.path.isdir(msg_dir):
+            continue
+        for f in sorted(os.listdir(msg_dir)):
+            if f.endswith('.msg') and f != 'Bad.msg':
+                msg_files.append(('%s/%s'%(pkg, f[:-4]), os.path.join(msg_dir, f)))
+    return msg_files
+
+def _best_of(func, repeat=5):
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+def bench_log():
+    """parse throughput of load_msg_from_string with logging disabled and enabled"""
+    from genmsg import base
+    from genmsg.msg_loader import MsgContext, load_msg_from_string
+    texts = []
+    for full_name, path in get_msg_files():
+        with open(path) as f:
+            texts.append((full_name, f.read()))
+
+    def parse():
+        msg_context = MsgContext()
+        for i in range(10):
+            for full_name, text in texts:
+                load_msg_from_string(msg_context, text, full_name)
+
+    stderr = sys.stderr
+    try:
+        for verbose in [False, True]:
+            base.log_verbose(verbose)
+            sys.stderr = open(os.devnull, 'w')
+            t = _best_of(parse)
+            sys.stderr.close()
+            sys.stderr = stderr
+            print("logging %-3s: %8.0f msgs/sec"%('on' if verbose else 'off', 10*len(texts)/t))
+    finally:
+        base.log_verbose(False)
+        sys.stderr = stderr
+
+def bench_parse():
+    """lines/sec of load_msg_from_string over all messages in test/files"""
+    from genmsg.msg_loader import MsgContext, load_msg_from_string
+    texts = []
+    for full_name, path in get_msg_files():
+        with open(path) as f:
+            texts.append((full_name, f.read()))
+    lines = sum([len(text.split('\n')) for _, text in texts])
+
+    def parse():
+        msg_context = MsgContext()
+        for i in range(10):
+            for full_name, text in texts:
+                load_msg_from_string(msg_context, text, full_name)
+    t = _best_of(parse)
+    print("%d messages, %d lines: %.0f lines/sec"%(len(texts), lines, 10*lines/t))
+
+def _load_all(msg_context):
+    """
+    Load all messages in test/files and their dependencies into *msg_context*.
+
+    :returns: list of loaded :class:`MsgSpec`
+    """
+    from genmsg.msg_loader import load_msg_by_type, load_msg_depends
+    test_dir = get_test_dir()
+    search_path = dict([(pkg, os.path.join(test_dir, pkg, 'msg')) for pkg in os.listdir(test_dir)])
+    specs = []
+    for full_name, path in get_msg_files():
+        spec = load_msg_by_type(msg_context, full_name, search_path)
+        load_msg_depends(msg_context, spec, search_path)
+        specs.append(spec)
+    return specs
+
+def bench_full_text():
+    """full texts/sec of compute_full_text over all messages in test/files"""
+    from genmsg.gentools import compute_full_text
+    from genmsg.msg_loader import MsgContext
+    msg_context = MsgContext.create_default()
+    specs = _load_all(msg_context)
+
+    def full_text():
+        for i in range(20):
+            for spec in specs:
+                compute_full_text(msg_context, spec)
+    t = _best_of(full_text)
+    print("%d messages: %.0f full texts/sec"%(len(specs), 20*len(specs)/t))
+
+def bench_md5():
+    """md5sums/sec of compute_md5 over the messages in test/md5tests, without md5 caching across runs"""
+    from genmsg.gentools import compute_md5
+    from genmsg.msg_loader import MsgContext, load_msg_from_string, load_msg_depends
+    test_dir = get_test_dir()
+    search_path = dict([(pkg, os.path.join(test_dir, pkg, 'msg')) for pkg in os.listdir(test_dir)])
+    md5tests_dir = os.path.join(os.path.dirname(test_dir), 'md5tests')
+    msg_context = MsgContext.create_default()
+    specs = []
+    for dir_name in ['same', 'different', 'md5text']:
+        for f in sorted(os.listdir(os.path.join(md5tests_dir, dir_name))):
+            with open(os.path.join(md5tests_dir, dir_name, f)) as fh:
+                text = fh.read()
+            # md5text/*1.txt are reference md5 texts
+            if dir_name == 'md5text' and f.endswith('1.txt'):
+                continue
+            spec = load_msg_from_string(msg_context, text, 'rosgraph_msgs/%s_%s'%(dir_name, f[:-4]))
+            load_msg_depends(msg_context, spec, search_path)
+            specs.append(spec)
+
+    def md5():
+        for i in range(20):
+            msg_context._md5s.clear()
+            for spec in specs:
+                compute_md5(msg_context, spec)
+    t = _best_of(md5)
+    print("%d messages: %.0f md5sums/sec"%(len(specs), 20*len(specs)/t))
+
+def bench_load_all():
+    """load_all compared to loading each file with load_msg_from_file and load_depends"""
+    from genmsg.msg_loader import MsgContext, load_all, load_msg_from_file, load_depends
+    test_dir = get_test_dir()
+    packages = ['geometry_msgs', 'rosgraph_msgs', 'sensor_msgs', 'std_msgs']
+    search_path = dict([(pkg, os.path.join(test_dir, pkg, 'msg')) for pkg in packages])
+    msg_files = [(full_name, path) for full_name, path in get_msg_files() if full_name.split('/')[0] in packages]
+
+    def per_file(shared):
+        msg_context = MsgContext.create_default()
+        for full_name, path in msg_files:
+            if not shared:
+                # as e.g. deps.find_msg_dependencies() does
+                msg_context = MsgContext.create_default()
+            spec = load_msg_from_file(msg_context, path, full_name)
+            msg_context.set_file(full_name, path)
+            load_depends(msg_context, spec, search_path)
+
+    def all_at_once():
+        load_all(MsgContext.create_default(), search_path)
+
+    t_load_all = _best_of(all_at_once)
+    print("%d messages: load_all %.1f ms"%(len(msg_files), 1000*t_load_all))
+    for shared in [False, True]:
+        t = _best_of(lambda: per_file(shared))
+        print("per file, %s context: %.1f ms (load_all %.1fx faster)"%(
+            'shared' if shared else 'new', 1000*t, t/t_load_all))
+
+def _deep_sizeof(roots):
+    """
+    :returns: bytes used by *roots* and everything they reference,
+      counting shared objects once, ``int``
+    """
+    seen = set()
+    size = 0
+    todo = list(roots)
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        todo.extend(gc.get_referents(obj))
+    return size
+
+def bench_memory():
+    """bytes per MsgSpec with all messages in test/files loaded into one context"""
+    from genmsg.msg_loader import MsgContext, load_msg_from_string
+    msg_context = MsgContext()
+    specs = []
+    for full_name, path in get_msg_files():
+        with open(path) as f:
+            specs.append(load_msg_from_string(msg_context, f.read(), full_name))
+    size = _deep_sizeof(specs)
+    print("%d specs, %d bytes: %.0f bytes/spec"%(len(specs), size, float(size)/len(specs)))
+
+BENCHMARKS = [('log', bench_log),
+              ('parse', bench_parse),
+              ('memory', bench_memory),
+              ('full_text', bench_full_text),
+              ('md5', bench_md5),
+              ('load_all', bench_load_all)]
+
+def main(names):
+    for name, bench in BENCHMARKS:
+        if not names or name in names:
+            print("%s: %s"%(name, bench.__doc__))
+            bench()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -14,3 +14,29 @@ def test_exceptions():
         raise InvalidMsgSpec('hello')
     except InvalidMsgSpec:
         pass    
+
+def test_memoize():
+    from genmsg.base import memoize
+    calls = []
+    @memoize(maxsize=2)
+    def double(x):
+        calls.append(x)
+        return 2 * x
+    assert 2 == double(1)
+    assert 2 == double(1)
+    assert [1] == calls
+    for x in range(5):
+        assert 2 * x == double(x)
+    assert 4 == double(2)
+
+def test_memoize_args():
+    from genmsg.base import memoize
+    calls = []
+    @memoize(maxsize=4)
+    def join(a, b):
+        calls.append((a, b))
+        return a + b
+    assert 'ab' == join('a', 'b')
+    assert 'ab' == join('a', 'b')
+    assert 'ba' == join('b', 'a')
+    assert [('a', 'b'), ('b', 'a')] == calls
@@ -0,0 +1,77 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+
+def get_test_dir():
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), 'files'))
+
+def get_search_path():
+    test_dir = get_test_dir()
+    search_path = {}
+    for pkg in ['std_msgs', 'geometry_msgs', 'test_ros']:
+        search_path[pkg] = os.path.join(test_dir, pkg, 'msg')
+    return search_path
+
+def test_find_package_dependencies():
+    from genmsg.deps import find_msg_dependencies, find_srv_dependencies, find_package_dependencies
+    test_dir = get_test_dir()
+    search_path = get_search_path()
+    geom_dir = os.path.join(test_dir, 'geometry_msgs', 'msg')
+    msg_files = [os.path.join(geom_dir, '%s.msg'%t) for t in ['Point', 'Pose', 'PoseStamped', 'PoseWithCovarianceStamped']]
+    srv_files = [os.path.join(test_dir, 'test_ros', 'srv', 'GetPoseStamped.srv'),
+                 os.path.join(test_dir, 'test_ros', 'srv', 'AddTwoInts.srv')]
+
+    deps = find_package_dependencies('geometry_msgs', msg_files, [], search_path)
+    assert set(deps.keys()) == set(msg_files)
+    for f in msg_files:
+        assert set(deps[f]) == set(find_msg_dependencies('geometry_msgs', f, search_path)), f
+    assert [] == deps[msg_files[0]]
+    assert set([os.path.join(geom_dir, 'Point.msg'), os.path.join(geom_dir, 'Quaternion.msg')]) == set(deps[msg_files[1]])
+
+    # files loaded as dependencies of other files are not parsed again
+    import genmsg.msg_loader
+    from genmsg.deps import _find_msg_dependencies
+    msg_context = genmsg.msg_loader.MsgContext.create_default()
+    _find_msg_dependencies(msg_context, 'geometry_msgs', msg_files[2], search_path)
+    pose = msg_context.get_registered('geometry_msgs/Pose')
+    genmsg.compute_md5(msg_context, pose)
+    assert set(deps[msg_files[1]]) == set(_find_msg_dependencies(msg_context, 'geometry_msgs', msg_files[1], search_path))
+    assert pose is msg_context.get_registered('geometry_msgs/Pose')
+    assert msg_context.get_md5('geometry_msgs/Pose') is not None
+
+    deps = find_package_dependencies('test_ros', [], srv_files, search_path)
+    for f in srv_files:
+        assert set(deps[f]) == set(find_srv_dependencies('test_ros', f, search_path)), f
+    assert [] == deps[srv_files[1]]
+    assert os.path.join(test_dir, 'std_msgs', 'msg', 'Header.msg') in deps[srv_files[0]]
@@ -144,6 +144,27 @@ def test_md5_not_equals():
         # each md5 should be unique
         assert len(md5s) == len(files)
     
+def test_compute_md5_cache():
+    from genmsg import MsgContext, compute_md5, load_msg_by_type, load_depends
+    from genmsg.msg_loader import load_msg_from_string
+    msg_context = MsgContext.create_default()
+
+    search_path = get_search_path()
+    spec = load_msg_by_type(msg_context, 'geometry_msgs/TwistWithCovarianceStamped', search_path)
+    load_depends(msg_context, spec, search_path)
+    md5sum = compute_md5(msg_context, spec)
+    # Twist embeds Vector3 twice, second lookup is a hit
+    assert msg_context.md5_hits == 1, msg_context.md5_hits
+    misses = msg_context.md5_misses
+    assert md5sum == compute_md5(msg_context, spec)
+    assert msg_context.md5_hits == 2
+    assert msg_context.md5_misses == misses
+
+    # replacing a spec invalidates the cache
+    load_msg_from_string(msg_context, 'float64 x', 'geometry_msgs/Vector3')
+    assert msg_context.get_md5('geometry_msgs/Vector3') is None
+    assert md5sum != compute_md5(msg_context, spec)
+
 twist_with_covariance_stamped_full_text = """# This represents an estimate twist with reference coordinate frame and timestamp.
 Header header
 TwistWithCovariance twist
@@ -248,3 +269,103 @@ def test_compute_full_text():
     load_depends(msg_context, spec, search_path)
     val = compute_full_text(msg_context, spec)
     assert val == twist_with_covariance_stamped_full_text, "[%s][%s]"%(val, twist_with_covariance_stamped_full_text)
+
+def test_compute_full_text_cache():
+    from genmsg import MsgContext, compute_full_text, load_msg_by_type, load_depends
+    from genmsg.msg_loader import load_msg_from_string
+    msg_context = MsgContext.create_default()
+
+    search_path = get_search_path()
+    spec = load_msg_by_type(msg_context, 'geometry_msgs/TwistWithCovarianceStamped', search_path)
+    load_depends(msg_context, spec, search_path)
+    val = compute_full_text(msg_context, spec)
+    assert val == twist_with_covariance_stamped_full_text
+    block = msg_context.get_text_block('std_msgs/Header')
+    assert block.startswith('='*80 + '\nMSG: std_msgs/Header\n# Standard metadata')
+    assert val == compute_full_text(msg_context, spec)
+    assert block is msg_context.get_text_block('std_msgs/Header')
+
+    # replacing a spec invalidates its block
+    load_msg_from_string(msg_context, 'float64 x', 'geometry_msgs/Vector3')
+    assert msg_context.get_text_block('geometry_msgs/Vector3') is None
+    assert block is msg_context.get_text_block('std_msgs/Header')
+    val = compute_full_text(msg_context, spec)
+    assert val.endswith('MSG: geometry_msgs/Vector3\nfloat64 x')
+
+def test_strip_lines():
+    import itertools
+    from genmsg.gentools import _strip_lines
+    pieces = ['', ' ', '\t', 'a', ' a ', 'b c']
+    for n in range(5):
+        for lines in itertools.product(pieces, repeat=n):
+            assert '\n'.join(lines).strip() == '\n'.join(_strip_lines(iter(lines))), lines
+
+def test_compute_md5_streaming():
+    # md5sums hashed from the lines as they are produced must match the
+    # md5sum of the md5 text
+    import hashlib
+    from genmsg import MsgContext
+    from genmsg.gentools import _md5_lines
+    msg_context = MsgContext.create_default()
+    for dir_name in ['same', 'different', 'md5text']:
+        for k, files in _load_md5_tests(dir_name).items():
+            for f in files:
+                if dir_name == 'md5text' and f.endswith('%s1.txt'%k):
+                    # reference md5 text, not a message
+                    continue
+                text = _compute_md5_text(msg_context, f)
+                assert hashlib.md5(text.encode('utf-8')).hexdigest() == _compute_md5(msg_context, f), f
+    # lines are produced one at a time and each line is fed to the
+    # hash by itself
+    from genmsg.gentools import _update_hash, compute_md5_text
+    class RecordingHash(object):
+        def __init__(self):
+            self.updates = []
+        def update(self, data):
+            self.updates.append(data)
+    for full_name in msg_context.get_registered_types():
+        spec = msg_context.get_registered(full_name)
+        lines = _md5_lines(msg_context, spec)
+        assert not isinstance(lines, list)
+        h = RecordingHash()
+        _update_hash(msg_context, spec, h)
+        text = compute_md5_text(msg_context, spec).encode('utf-8')
+        assert text == b''.join(h.updates), full_name
+        if text:
+            assert text.split(b'\n') == [u for u in h.updates if u != b'\n'], full_name
+
+def test_compute_md5_all():
+    from genmsg import MsgContext, compute_md5, compute_md5_all, load_msg_by_type, load_depends
+    from genmsg.msg_loader import load_srv_from_file
+    search_path = get_search_path()
+    msg_context = MsgContext.create_default()
+    for msg_type in ['rosgraph_msgs/Log', 'geometry_msgs/TwistWithCovarianceStamped', 'geometry_msgs/PoseStamped']:
+        spec = load_msg_by_type(msg_context, msg_type, search_path)
+        load_depends(msg_context, spec, search_path)
+    srv_path = os.path.join(get_test_msg_dir(), 'test_ros', 'srv', 'GetPoseStamped.srv')
+    srv_spec = load_srv_from_file(msg_context, srv_path, 'test_ros/GetPoseStamped')
+    load_depends(msg_context, srv_spec, search_path)
+
+    md5s = compute_md5_all(msg_context, [srv_spec])
+    types = msg_context.get_registered_types()
+    assert set(types + ['test_ros/GetPoseStamped']) == set(md5s.keys())
+    assert 'std_msgs/Header' in types and 'time' in types
+    # each type hashed once
+    assert len(types) == msg_context.md5_misses, (len(types), msg_context.md5_misses)
+
+    # same values as computing them one by one in a fresh context
+    fresh_context = MsgContext.create_default()
+    for msg_type in types:
+        if msg_type.startswith('test_ros/'):
+            continue
+        if fresh_context.is_registered(msg_type):
+            # time, duration
+            spec = fresh_context.get_registered(msg_type)
+        else:
+            spec = load_msg_by_type(fresh_context, msg_type, search_path)
+            load_depends(fresh_context, spec, search_path)
+        assert md5s[msg_type] == compute_md5(fresh_context, spec), msg_type
+    srv_spec = load_srv_from_file(fresh_context, srv_path, 'test_ros/GetPoseStamped')
+    load_depends(fresh_context, srv_spec, search_path)
+    assert md5s['test_ros/GetPoseStamped'] == compute_md5(fresh_context, srv_spec)
+    assert md5s['test_ros/GetPoseStampedResponse'] == compute_md5(fresh_context, srv_spec.response)
@@ -152,6 +152,33 @@ def test__load_field_line():
     f =_load_field_line("Header header #nonsense", '')
     assert f == ('std_msgs/Header', 'header'), f
 
+def test__parse_lines():
+    # single pass tokenizers must agree with _load_field_line/_load_constant_line
+    from genmsg.msg_loader import _load_field_line, _load_constant_line, _parse_field_line, _parse_constant_line, \
+         _strip_comments, InvalidMsgSpec
+    def parse(f, *args):
+        try:
+            return f(*args)
+        except InvalidMsgSpec:
+            return None
+    field_lines = ["string str", "string  str #nonsense", "String str", "Header header", "int32[] a", "int32[3]  b",
+                   "int32[3][] c", "foo/Bar bar", "foo//Bar bar", "int32\t x", "int32\tx", "  int32 x  ", "int32[ x",
+                   "int32 x!", "int32 x y", "1nt32 x", "int32 _x", "int32 x\r"]
+    for line in field_lines:
+        for package_context in ['', 'foo']:
+            clean_line = _strip_comments(line)
+            assert parse(_load_field_line, line, package_context) == parse(_parse_field_line, line, clean_line, package_context), line
+    constant_lines = ["int8 field=1", "int8 field = 1 # one", "int8 field=alpha", "int8 field=", "int8 a b=1", "faketype field=1",
+                      "string val=hello #world", "string val = hello = world", " string val=x", "string\tval=x",
+                      "float64 PI=3.14", "bool B=True", "uint8 X=256", "int8  X\t=\t-1"]
+    for line in constant_lines:
+        clean_line = _strip_comments(line)
+        c = parse(_load_constant_line, line)
+        c2 = parse(_parse_constant_line, line, clean_line)
+        assert c == c2, line
+        if c is not None:
+            assert (c.name, c.val_text) == (c2.name, c2.val_text), line
+
 def test_load_msg_from_string():
     # make sure Header -> std_msgs/Header conversion works
     from genmsg.msgs import Constant
@@ -220,6 +247,72 @@ def test_load_msg_from_file():
     # supposed to register
     assert msg_context.is_registered('test_ros/TestString'), msg_context
     
+def test_load_msg_from_file_cache():
+    import shutil
+    import tempfile
+    from genmsg.msg_loader import load_msg_from_file, MsgContext
+    tmp_d = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(tmp_d, 'cache')
+        msg_path = os.path.join(tmp_d, 'TestString.msg')
+        shutil.copy(os.path.join(get_test_dir(), 'test_ros', 'msg', 'TestString.msg'), msg_path)
+        os.utime(msg_path, (1300000000, 1300000000))
+
+        spec = load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        _validate_TestString(spec)
+        assert len(os.listdir(cache_dir)) == 1
+
+        msg_context = MsgContext.create_default(cache_dir)
+        spec_2 = load_msg_from_file(msg_context, msg_path, 'test_ros/TestString')
+        assert spec == spec_2
+        assert msg_context.get_registered('test_ros/TestString') is spec_2
+        # type name is part of the key
+        assert 'other_ros/TestString' == load_msg_from_file(msg_context, msg_path, 'other_ros/TestString').full_name
+        assert len(os.listdir(cache_dir)) == 2
+
+        # same mtime and size: served from cache without reading the file
+        with open(msg_path, 'w') as f:
+            f.write(spec.text.replace('data', 'dat2'))
+        os.utime(msg_path, (1300000000, 1300000000))
+        assert spec == load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+
+        # changed content is parsed again
+        with open(msg_path, 'w') as f:
+            f.write('int32 x')
+        spec_3 = load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        assert ['int32'] == spec_3.types
+        assert spec_3 == load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+
+        # touched but unchanged: the new stamp is saved
+        import json
+        from genmsg.msg_loader import _cache_file
+        cache_file = _cache_file(MsgContext(cache_dir), msg_path, 'test_ros/TestString')
+        os.utime(msg_path, (1400000000, 1400000000))
+        assert spec_3 == load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        with open(cache_file) as f:
+            assert 1400000000 == json.load(f)['mtime']
+
+        # constants
+        with open(msg_path, 'w') as f:
+            f.write('int32 X=1\nfloat64 Y=1.5\nbool Z=True\nstring S=foo # bar\nint32 x')
+        spec_4 = load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        spec_5 = load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        assert spec_4 == spec_5
+        assert [(c.type, c.name, c.val, c.val_text) for c in spec_4.constants] == \
+            [(c.type, c.name, c.val, c.val_text) for c in spec_5.constants]
+        assert [type(c.val) for c in spec_4.constants] == [type(c.val) for c in spec_5.constants]
+        assert all([type(t) is str for t in spec_5.types + spec_5.names + [spec_5.text]])
+
+        # only JSON is read from the cache, never pickles
+        import pickle
+        with open(cache_file, 'wb') as f:
+            pickle.dump(dict(version=2), f)
+        assert spec_4 == load_msg_from_file(MsgContext.create_default(cache_dir), msg_path, 'test_ros/TestString')
+        with open(cache_file) as f:
+            assert 'test_ros/TestString' == json.load(f)['full_name']
+    finally:
+        shutil.rmtree(tmp_d)
+
 def test_load_msg_from_string_TestString():
     from genmsg.msg_loader import load_msg_from_string, MsgContext
 
@@ -310,6 +403,82 @@ def test_get_msg_file():
     except ValueError:
         pass
 
+def test_SearchPathIndex():
+    import shutil
+    import tempfile
+    from genmsg import MsgNotFound, SearchPathIndex, MsgContext, load_msg_by_type
+    from genmsg.msg_loader import get_msg_file, get_srv_file
+    test_d = get_test_dir()
+    test_ros_dir = os.path.join(test_d, 'test_ros', 'msg')
+    search_path = SearchPathIndex({'test_ros': test_ros_dir, 'dne': os.path.join(test_d, 'dne')})
+    assert isinstance(search_path, dict)
+    assert test_ros_dir == search_path['test_ros']
+    assert os.path.join(test_ros_dir, 'TestString.msg') == get_msg_file('test_ros', 'TestString', search_path)
+    for package, base_type in [('test_ros', 'DNE'), ('bad_pkg', 'TestString'), ('dne', 'TestString')]:
+        try:
+            get_msg_file(package, base_type, search_path)
+            assert False, "should have raised"
+        except MsgNotFound:
+            pass
+    _validate_TestString(load_msg_by_type(MsgContext.create_default(), 'test_ros/TestString', search_path))
+
+    search_path['std_srvs'] = os.path.join(test_d, 'std_srvs', 'srv')
+    assert os.path.join(test_d, 'std_srvs', 'srv', 'Empty.srv') == get_srv_file('std_srvs', 'Empty', search_path)
+
+    # directories are only listed once
+    tmp_d = tempfile.mkdtemp()
+    try:
+        search_path = SearchPathIndex({'tmp': tmp_d})
+        try:
+            get_msg_file('tmp', 'TestString', search_path)
+            assert False, "should have raised"
+        except MsgNotFound:
+            pass
+        shutil.copy(os.path.join(test_ros_dir, 'TestString.msg'), tmp_d)
+        try:
+            get_msg_file('tmp', 'TestString', search_path)
+            assert False, "should have raised"
+        except MsgNotFound:
+            pass
+        search_path.update({'tmp': tmp_d})
+        assert os.path.join(tmp_d, 'TestString.msg') == get_msg_file('tmp', 'TestString', search_path)
+
+        # all mutators drop the listing of the package
+        def add_file(name):
+            open(os.path.join(tmp_d, name), 'w').close()
+        search_path = SearchPathIndex({'tmp': tmp_d})
+        assert not search_path.contains('tmp', 'A.msg')
+        add_file('A.msg')
+        assert not search_path.contains('tmp', 'A.msg')
+        assert tmp_d == search_path.pop('tmp')
+        search_path.setdefault('tmp', tmp_d)
+        assert search_path.contains('tmp', 'A.msg')
+        add_file('B.msg')
+        del search_path['tmp']
+        search_path.setdefault('tmp', tmp_d)
+        assert search_path.contains('tmp', 'B.msg')
+        add_file('C.msg')
+        search_path.clear()
+        search_path.setdefault('tmp', tmp_d)
+        assert search_path.contains('tmp', 'C.msg')
+        add_file('D.msg')
+        assert ('tmp', tmp_d) == search_path.popitem()
+        search_path.setdefault('tmp', tmp_d)
+        assert search_path.contains('tmp', 'D.msg')
+    finally:
+        shutil.rmtree(tmp_d)
+
+    # pickled without the listings
+    import pickle
+    search_path = SearchPathIndex({'test_ros': test_ros_dir})
+    assert search_path.contains('test_ros', 'TestString.msg')
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(search_path, protocol))
+        assert isinstance(copy, SearchPathIndex)
+        assert search_path == copy
+        assert copy.contains('test_ros', 'TestString.msg')
+    assert isinstance(search_path.copy(), SearchPathIndex)
+
 def test_get_srv_file():
     from genmsg import MsgNotFound
     from genmsg.msg_loader import get_srv_file
@@ -379,6 +548,147 @@ def test_MsgContext():
     msg_context.register('std_msgs/Header', spec)
     assert msg_context.is_registered('std_msgs/Header')
 
+def test_MsgContext_get_depends_closure():
+    from genmsg.msg_loader import MsgContext
+    msg_context = MsgContext()
+    msg_context.set_depends('a/D', [])
+    msg_context.set_depends('a/C', ['a/D'])
+    msg_context.set_depends('a/B', ['a/D', 'a/C'])
+    msg_context.set_depends('a/A', ['a/B', 'a/C', 'a/D'])
+    assert ['a/B', 'a/D', 'a/C', 'a/D', 'a/C', 'a/D', 'a/D'] == msg_context.get_all_depends('a/A')
+    assert ('a/B', 'a/D', 'a/C') == msg_context.get_depends_closure('a/A')
+    assert ('a/D', 'a/C') == msg_context.get_depends_closure('a/B')
+    assert () == msg_context.get_depends_closure('a/D')
+    # memoized
+    assert msg_context.get_depends_closure('a/B') is msg_context.get_depends_closure('a/B')
+    # unchanged dependencies keep closures
+    closure = msg_context.get_depends_closure('a/A')
+    msg_context.set_depends('a/C', ['a/D'])
+    assert closure is msg_context.get_depends_closure('a/A')
+    # changed dependencies invalidate them
+    msg_context.set_depends('a/E', [])
+    msg_context.set_depends('a/C', ['a/E'])
+    assert ('a/B', 'a/D', 'a/C', 'a/E') == msg_context.get_depends_closure('a/A')
+
+def test_MsgContext_dump_load():
+    import shutil
+    import tempfile
+    from genmsg.gentools import compute_md5
+    from genmsg.msg_loader import MsgContext, load_msg_by_type, load_msg_depends
+    test_d = get_test_dir()
+    tmp_d = tempfile.mkdtemp()
+    try:
+        msg_dir = os.path.join(tmp_d, 'geometry_msgs')
+        shutil.copytree(os.path.join(test_d, 'geometry_msgs', 'msg'), msg_dir)
+        search_path = {
+            'std_msgs': os.path.join(test_d, 'std_msgs', 'msg'),
+            'geometry_msgs': msg_dir,
+            }
+        msg_context = MsgContext.create_default()
+        spec = load_msg_by_type(msg_context, 'geometry_msgs/PoseStamped', search_path)
+        load_msg_depends(msg_context, spec, search_path)
+        md5sum = compute_md5(msg_context, spec)
+
+        dump_path = os.path.join(tmp_d, 'context.dump')
+        msg_context.dump(dump_path)
+        for validate in [False, True]:
+            loaded = MsgContext.load(dump_path, validate)
+            assert loaded._registered_packages == msg_context._registered_packages
+            assert loaded._files == msg_context._files
+            assert loaded._dependencies == msg_context._dependencies
+            assert md5sum == loaded.get_md5('geometry_msgs/PoseStamped')
+            assert loaded.is_registered('time')
+            loaded_spec = loaded.get_registered('geometry_msgs/PoseStamped')
+            assert spec == loaded_spec
+            assert md5sum == compute_md5(loaded, loaded_spec)
+
+        # modified source file
+        os.utime(os.path.join(msg_dir, 'Pose.msg'), (1300000000, 1300000000))
+        assert MsgContext.load(dump_path, validate=True) is None
+        assert MsgContext.load(dump_path) is not None
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_ThreadSafeMsgContext():
+    import threading
+    import time
+    from genmsg import InvalidMsgSpec
+    from genmsg.msg_loader import ThreadSafeMsgContext, load_msg_from_string, \
+        load_msg_by_type, load_msg_depends
+    msg_context = ThreadSafeMsgContext.create_default()
+    assert isinstance(msg_context, ThreadSafeMsgContext)
+    assert msg_context.is_registered('time')
+
+    # concurrent loads of the same type are done once
+    loads = []
+    def load():
+        loads.append(1)
+        time.sleep(0.05)
+        return load_msg_from_string(msg_context, 'int32 x', 'a/B')
+    specs = []
+    def worker():
+        specs.append(msg_context.get_or_load('a/B', load))
+    threads = [threading.Thread(target=worker) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [1] == loads
+    assert 8 == len(specs)
+    assert all([s is specs[0] for s in specs])
+
+    # md5sums and text blocks of a spec replaced while they were
+    # computed are not cached
+    load_msg_from_string(msg_context, 'int32 y', 'a/B')
+    msg_context.set_md5('a/B', 'stale', specs[0])
+    msg_context.set_text_block('a/B', 'stale', specs[0])
+    assert msg_context.get_md5('a/B') is None
+    assert msg_context.get_text_block('a/B') is None
+    msg_context.set_md5('a/B', 'md5', msg_context.get_registered('a/B'))
+    assert 'md5' == msg_context.get_md5('a/B')
+
+    # failed loads are retried by waiting threads
+    def bad_load():
+        loads.append(1)
+        time.sleep(0.05)
+        raise InvalidMsgSpec('bad')
+    errors = []
+    def bad_worker():
+        try:
+            msg_context.get_or_load('a/Bad', bad_load)
+        except InvalidMsgSpec:
+            errors.append(1)
+    del loads[:]
+    threads = [threading.Thread(target=bad_worker) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert 4 == len(errors) == len(loads)
+    assert not msg_context.is_registered('a/Bad')
+
+    # concurrent dependency loading into one shared context
+    test_d = get_test_dir()
+    search_path = {
+        'std_msgs': os.path.join(test_d, 'std_msgs', 'msg'),
+        'geometry_msgs': os.path.join(test_d, 'geometry_msgs', 'msg'),
+        'sensor_msgs': os.path.join(test_d, 'sensor_msgs', 'msg'),
+        }
+    msg_types = ['sensor_msgs/Imu', 'sensor_msgs/PointCloud', 'geometry_msgs/PoseStamped',
+                 'geometry_msgs/TwistWithCovarianceStamped']
+    msg_context = ThreadSafeMsgContext.create_default()
+    def depends_worker(msg_type):
+        spec = load_msg_by_type(msg_context, msg_type, search_path)
+        load_msg_depends(msg_context, spec, search_path)
+    threads = [threading.Thread(target=depends_worker, args=(msg_type,)) for msg_type in msg_types]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for msg_type in msg_types:
+        assert 'std_msgs/Header' in msg_context.get_depends_closure(msg_type)
+    assert msg_context.get_file('geometry_msgs/Pose')
+
 def test_load_srv_from_file():
     from genmsg.msg_loader import MsgContext, load_srv_from_file
         
@@ -457,6 +767,56 @@ def test_load_msg_depends():
         file_p = os.path.join(test_d, 'std_msgs', 'msg', '%s.msg'%s)
         assert file_p == msg_context.get_file('std_msgs/%s'%s)
 
+def test_load_msg_depends_prefetch():
+    from genmsg.msg_loader import MsgContext, load_msg_by_type, load_msg_depends, MsgNotFound
+    test_d = get_test_dir()
+    search_path = {
+        'std_msgs': os.path.join(test_d, 'std_msgs', 'msg'),
+        'geometry_msgs': os.path.join(test_d, 'geometry_msgs', 'msg'),
+        'sensor_msgs': os.path.join(test_d, 'sensor_msgs', 'msg'),
+        'invalid': os.path.join(test_d, 'invalid', 'msg'),
+        }
+    for msg_type in ['sensor_msgs/Imu', 'sensor_msgs/PointCloud', 'geometry_msgs/TwistWithCovarianceStamped']:
+        contexts = []
+        for jobs in [1, 4]:
+            msg_context = MsgContext.create_default()
+            root_spec = load_msg_by_type(msg_context, msg_type, search_path)
+            depends = load_msg_depends(msg_context, root_spec, search_path, jobs)
+            contexts.append((msg_context, depends))
+        (seq_context, seq_depends), (context, depends) = contexts
+        assert seq_depends == depends
+        assert seq_context._registered_packages == context._registered_packages
+        assert seq_context._dependencies == context._dependencies
+        assert seq_context._files == context._files
+
+    msg_context = MsgContext.create_default()
+    root_spec = load_msg_by_type(msg_context, 'invalid/BadDepend', search_path)
+    try:
+        load_msg_depends(msg_context, root_spec, search_path, 4)
+        assert False, "should have raised MsgNotFound"
+    except MsgNotFound:
+        pass
+
+def test_load_msg_depends_cycle():
+    from genmsg import InvalidMsgSpec
+    from genmsg.msg_loader import MsgContext, load_msg_from_string, load_msg_depends
+    msg_context = MsgContext.create_default()
+    specs = {}
+    for full_name, text in [('cyc/A', 'B b'), ('cyc/B', 'int32 x\nC c'),
+                            ('cyc/C', 'A a'), ('cyc/Self', 'Self[] children')]:
+        specs[full_name] = load_msg_from_string(msg_context, text, full_name)
+        msg_context.register(full_name, specs[full_name])
+    try:
+        load_msg_depends(msg_context, specs['cyc/A'], {})
+        assert False, "should have raised"
+    except InvalidMsgSpec as e:
+        assert 'cyc/A -> cyc/B -> cyc/C -> cyc/A' in str(e), str(e)
+    try:
+        load_msg_depends(msg_context, specs['cyc/Self'], {})
+        assert False, "should have raised"
+    except InvalidMsgSpec as e:
+        assert 'cyc/Self -> cyc/Self' in str(e), str(e)
+
 def test_load_msg_depends_stamped():
     #TODO: should there just be a 'load_msg, implicit=True?'
     from genmsg.msg_loader import MsgContext, load_msg_by_type, load_msg_depends
@@ -616,6 +976,59 @@ def test_load_depends_srv():
     except ValueError:
         pass
     
+def test_load_all():
+    from genmsg.msg_loader import MsgContext, load_all, load_msg_by_type, load_depends, MsgNotFound
+    test_d = get_test_dir()
+    search_path = {
+        'std_msgs': os.path.join(test_d, 'std_msgs', 'msg'),
+        'geometry_msgs': os.path.join(test_d, 'geometry_msgs', 'msg'),
+        }
+    srv_search_path = {
+        'test_ros': os.path.join(test_d, 'test_ros', 'srv'),
+        'std_srvs': os.path.join(test_d, 'std_srvs', 'srv'),
+        }
+    msg_context = MsgContext.create_default()
+    types = load_all(msg_context, search_path, ['geometry_msgs', 'test_ros'], srv_search_path)
+    assert ['geometry_msgs', 'test_ros'] == sorted(types.keys())
+    assert ['test_ros/AddTwoInts', 'test_ros/GetPoseStamped'] == types['test_ros']
+    geometry_msgs = sorted(['geometry_msgs/%s'%f[:-4] for f in os.listdir(search_path['geometry_msgs'])])
+    assert geometry_msgs == types['geometry_msgs']
+    # dependencies outside of packages are loaded
+    assert msg_context.is_registered('std_msgs/Header')
+    assert not msg_context.is_registered('std_msgs/Int32')
+    assert msg_context.get_file('std_msgs/Header') == os.path.join(search_path['std_msgs'], 'Header.msg')
+    assert ['geometry_msgs/PoseStamped'] == msg_context.get_depends('test_ros/GetPoseStampedResponse')
+    assert [] == msg_context.get_depends('test_ros/AddTwoIntsRequest')
+
+    # same as loading each message by itself
+    for msg_type in geometry_msgs:
+        other_context = MsgContext.create_default()
+        spec = load_msg_by_type(other_context, msg_type, search_path)
+        load_depends(other_context, spec, search_path)
+        assert spec == msg_context.get_registered(msg_type)
+        assert other_context.get_depends(msg_type) == msg_context.get_depends(msg_type)
+        assert other_context.get_file(msg_type) == msg_context.get_file(msg_type)
+
+    # loading again parses nothing and keeps cached md5sums
+    import genmsg
+    specs = dict([(t, msg_context.get_registered(t)) for t in msg_context.get_registered_types()])
+    md5 = genmsg.compute_md5(msg_context, msg_context.get_registered('test_ros/GetPoseStampedRequest'))
+    assert types == load_all(msg_context, search_path, ['geometry_msgs', 'test_ros'], srv_search_path)
+    for t, spec in specs.items():
+        assert spec is msg_context.get_registered(t), t
+    assert md5 == msg_context.get_md5('test_ros/GetPoseStampedRequest')
+
+    # all packages by default
+    types = load_all(MsgContext.create_default(), search_path, srv_search_path=srv_search_path)
+    assert ['geometry_msgs', 'std_msgs', 'std_srvs', 'test_ros'] == sorted(types.keys())
+    assert ['std_srvs/Empty'] == types['std_srvs']
+
+    try:
+        load_all(MsgContext.create_default(), {'invalid': os.path.join(test_d, 'invalid', 'msg')})
+        assert False, "should have raised"
+    except MsgNotFound:
+        pass
+
 def test_load_srv_by_type():
     from genmsg.msg_loader import load_srv_by_type, MsgContext, MsgNotFound
     
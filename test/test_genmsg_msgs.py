@@ -87,6 +87,27 @@ def test_parse_type():
         except ValueError as e:
             pass
 
+def test_type_descriptor():
+    from genmsg.msgs import type_descriptor
+    d = type_descriptor('std_msgs/String[3]')
+    assert ('std_msgs/String', True, 3, False, False) == d
+    assert 'std_msgs/String' == d.base_type
+    assert d.is_array
+    assert 3 == d.array_len
+    assert not d.is_builtin
+    assert not d.is_header
+    # cached
+    assert d is type_descriptor('std_msgs/String[3]')
+    assert ('int8', True, None, True, False) == type_descriptor('int8[]')
+    assert ('Header', False, None, False, True) == type_descriptor('Header')
+    assert ('std_msgs/Header', False, None, False, True) == type_descriptor('std_msgs/Header')
+    for f in ['a[1][2]', '', None, 'a[[1]']:
+        try:
+            type_descriptor(f)
+            assert False, "should have failed on %s"%f
+        except ValueError as e:
+            pass
+
 def test_Constant():
     import genmsg.msgs    
     vals = [random.randint(0, 1000) for i in xrange(0, 3)]
@@ -210,6 +231,26 @@ def test_MsgSpec():
     # test that repr doesn't throw an error
     [repr(x) for x in [empty, one_field, one_header, two_fields, embed_types]]
 
+def test_MsgSpec_fields_not_shared():
+    from genmsg import MsgSpec
+    a = MsgSpec(['int32', 'string'], ['x', 'y'], [], 'int32 x\nstring y\n', 'test_pkg/A')
+    b = MsgSpec(['int32', 'string'], ['x', 'z'], [], 'int32 x\nstring z\n', 'test_pkg/B')
+    assert a.parsed_fields()[0] == b.parsed_fields()[0]
+    # fields are mutable, changes must not leak into other specs
+    assert a.parsed_fields()[0] is not b.parsed_fields()[0]
+    a.parsed_fields()[0].name = 'w'
+    assert 'x' == b.parsed_fields()[0].name
+    assert not hasattr(a, '__dict__')
+
+def test_MsgSpec_lazy_fields():
+    from genmsg import MsgSpec
+    m = MsgSpec(['int32', 'std_msgs/String[2]'], ['x', 'y'], [], 'int32 x\nstd_msgs/String[2] y\n', 'test_pkg/Lazy')
+    assert m._parsed_fields is None
+    fields = m.parsed_fields()
+    assert ['x', 'y'] == [f.name for f in fields]
+    assert 2 == fields[1].array_len
+    assert fields is m.parsed_fields()
+
 def test_Field():
     from genmsg.msgs import Field
 
@@ -0,0 +1,300 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2011, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+import shutil
+import tempfile
+
+MSG_TEMPLATE = """@(spec.full_name) @(md5sum)
+@[for f in spec.parsed_fields()]@
+@(f.type) @(f.name)
+@[end for]@
+"""
+SRV_TEMPLATE = """srv @(spec.full_name) @(md5sum)
+"""
+
+def get_test_dir():
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), 'files'))
+
+def get_include_path():
+    test_dir = get_test_dir()
+    return ['%s:%s'%(pkg, os.path.join(test_dir, pkg, 'msg')) for pkg in ['std_msgs', 'geometry_msgs']]
+
+def _write_templates(template_dir):
+    with open(os.path.join(template_dir, 'msg.template'), 'w') as f:
+        f.write(MSG_TEMPLATE)
+    with open(os.path.join(template_dir, 'srv.template'), 'w') as f:
+        f.write(SRV_TEMPLATE)
+
+def test_generate_from_files():
+    from genmsg.template_tools import generate_from_files
+    test_dir = get_test_dir()
+    input_files = [os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg'),
+                   os.path.join(test_dir, 'geometry_msgs', 'msg', 'PoseStamped.msg'),
+                   os.path.join(test_dir, 'test_ros', 'srv', 'GetPoseStamped.srv')]
+    tmp_d = tempfile.mkdtemp()
+    try:
+        template_dir = os.path.join(tmp_d, 'templates')
+        output_dir = os.path.join(tmp_d, 'out')
+        os.makedirs(template_dir)
+        _write_templates(template_dir)
+        assert (5, 0) == generate_from_files(input_files, 'geometry_msgs', output_dir, template_dir, get_include_path(),
+                                             {'msg.template': '@NAME@.txt'}, {'srv.template': '@NAME@.txt'})
+        assert set(['Pose.txt', 'PoseStamped.txt', 'GetPoseStamped.txt', 'GetPoseStampedRequest.txt', 'GetPoseStampedResponse.txt']) == \
+            set(os.listdir(output_dir))
+        with open(os.path.join(output_dir, 'PoseStamped.txt')) as f:
+            assert "geometry_msgs/PoseStamped d3812c3cbc69362b77dc0b19b345f8f5\nstd_msgs/Header header\ngeometry_msgs/Pose pose\n" == f.read()
+        with open(os.path.join(output_dir, 'GetPoseStamped.txt')) as f:
+            assert f.read().startswith('srv geometry_msgs/GetPoseStamped ')
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_generate_from_files_parse_once():
+    import genmsg.msg_loader
+    from genmsg.template_tools import generate_from_files
+    test_dir = get_test_dir()
+    msg_dir = os.path.join(test_dir, 'geometry_msgs', 'msg')
+    # dependencies first and last
+    input_files = [os.path.join(msg_dir, '%s.msg'%t) for t in ['Pose', 'Point', 'PoseStamped', 'Quaternion']]
+    tmp_d = tempfile.mkdtemp()
+    load_msg_from_string = genmsg.msg_loader.load_msg_from_string
+    parsed = []
+    def counting_load(msg_context, text, full_name):
+        parsed.append(full_name)
+        return load_msg_from_string(msg_context, text, full_name)
+    genmsg.msg_loader.load_msg_from_string = counting_load
+    try:
+        template_dir = tmp_d
+        _write_templates(template_dir)
+        assert (4, 0) == generate_from_files(input_files, 'geometry_msgs', os.path.join(tmp_d, 'out'), template_dir, get_include_path(),
+                                             {'msg.template': '@NAME@.txt'}, {})
+        for t in ['Pose', 'Point', 'PoseStamped', 'Quaternion', 'std_msgs/Header']:
+            if '/' not in t:
+                t = 'geometry_msgs/' + t
+            assert 1 == parsed.count(t), (t, parsed)
+    finally:
+        genmsg.msg_loader.load_msg_from_string = load_msg_from_string
+        shutil.rmtree(tmp_d)
+
+def test_generate_from_files_jobs():
+    from genmsg.template_tools import generate_from_files
+    test_dir = get_test_dir()
+    input_files = [os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg'),
+                   os.path.join(test_dir, 'geometry_msgs', 'msg', 'PoseStamped.msg'),
+                   os.path.join(test_dir, 'test_ros', 'srv', 'GetPoseStamped.srv')]
+    tmp_d = tempfile.mkdtemp()
+    try:
+        template_dir = tmp_d
+        _write_templates(template_dir)
+        outputs = []
+        for jobs in [1, 2]:
+            output_dir = os.path.join(tmp_d, 'out%d'%jobs)
+            assert (5, 0) == generate_from_files(input_files, 'geometry_msgs', output_dir, template_dir, get_include_path(),
+                                                 {'msg.template': '@NAME@.txt'}, {'srv.template': '@NAME@.txt'}, jobs)
+            files = {}
+            for f in os.listdir(output_dir):
+                with open(os.path.join(output_dir, f)) as f_:
+                    files[f] = f_.read()
+            outputs.append(files)
+        # the pool generates exactly what a single process does
+        assert 5 == len(outputs[0])
+        assert outputs[0] == outputs[1]
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_generate_write_if_changed():
+    from genmsg.template_tools import generate_from_files
+    test_dir = get_test_dir()
+    input_files = [os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg'),
+                   os.path.join(test_dir, 'geometry_msgs', 'msg', 'Point.msg')]
+    tmp_d = tempfile.mkdtemp()
+    try:
+        template_dir = tmp_d
+        output_dir = os.path.join(tmp_d, 'out')
+        _write_templates(template_dir)
+        args = (input_files, 'geometry_msgs', output_dir, template_dir, get_include_path(), {'msg.template': '@NAME@.txt'}, {})
+        assert (2, 0) == generate_from_files(*args)
+        pose_file = os.path.join(output_dir, 'Pose.txt')
+        point_file = os.path.join(output_dir, 'Point.txt')
+        os.utime(pose_file, (1300000000, 1300000000))
+        with open(point_file, 'w') as f:
+            f.write('stale')
+
+        assert (1, 1) == generate_from_files(*args)
+        assert 1300000000 == os.stat(pose_file).st_mtime
+        with open(point_file) as f:
+            assert f.read().startswith('geometry_msgs/Point ')
+        assert set(['Pose.txt', 'Point.txt']) == set(os.listdir(output_dir))
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_generate_incremental():
+    import genmsg.msg_loader
+    from genmsg.template_tools import generate_from_files, MANIFEST_FILE
+    test_dir = get_test_dir()
+    tmp_d = tempfile.mkdtemp()
+    try:
+        msg_dir = os.path.join(tmp_d, 'msg')
+        template_dir = tmp_d
+        output_dir = os.path.join(tmp_d, 'out')
+        os.makedirs(msg_dir)
+        for t in ['Point', 'Pose', 'Quaternion']:
+            shutil.copy(os.path.join(test_dir, 'geometry_msgs', 'msg', '%s.msg'%t), msg_dir)
+        _write_templates(template_dir)
+        input_files = [os.path.join(msg_dir, 'Pose.msg'), os.path.join(msg_dir, 'Quaternion.msg')]
+        include_path = ['geometry_msgs:%s'%msg_dir]
+        args = (input_files, 'geometry_msgs', output_dir, template_dir, include_path, {'msg.template': '@NAME@.txt'}, {})
+
+        assert (2, 0) == generate_from_files(*args, incremental=True)
+        assert os.path.isfile(os.path.join(output_dir, MANIFEST_FILE))
+
+        # nothing changed: files are not even loaded
+        load_msg_from_file = genmsg.msg_loader.load_msg_from_file
+        def fail(*args):
+            assert False, "should not load %s"%args[1]
+        genmsg.msg_loader.load_msg_from_file = fail
+        try:
+            assert (0, 2) == generate_from_files(*args, incremental=True)
+        finally:
+            genmsg.msg_loader.load_msg_from_file = load_msg_from_file
+
+        # change of a dependency changes the md5sum of Pose
+        with open(os.path.join(msg_dir, 'Point.msg'), 'a') as f:
+            f.write('float64 w\n')
+        assert (1, 1) == generate_from_files(*args, incremental=True)
+
+        # touched but unchanged
+        os.utime(os.path.join(msg_dir, 'Quaternion.msg'), (1300000000, 1300000000))
+        assert (0, 2) == generate_from_files(*args, incremental=True)
+
+        # template change affects all
+        with open(os.path.join(template_dir, 'msg.template'), 'a') as f:
+            f.write('\n')
+        import genmsg.template_tools
+        genmsg.template_tools._templates.clear()
+        assert (2, 0) == generate_from_files(*args, incremental=True)
+
+        # deleted output is regenerated
+        os.remove(os.path.join(output_dir, 'Pose.txt'))
+        assert (1, 1) == generate_from_files(*args, incremental=True)
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_generate_incremental_config():
+    from genmsg.template_tools import generate_from_files
+    test_dir = get_test_dir()
+    tmp_d = tempfile.mkdtemp()
+    try:
+        template_dir = tmp_d
+        output_dir = os.path.join(tmp_d, 'out')
+        _write_templates(template_dir)
+        generator = os.path.join(tmp_d, 'gen_test.py')
+        with open(generator, 'w') as f:
+            f.write('# v1\n')
+        input_files = [os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg'),
+                       os.path.join(test_dir, 'test_ros', 'srv', 'GetPoseStamped.srv')]
+        def generate(msg_template_dict):
+            return generate_from_files(input_files, 'geometry_msgs', output_dir, template_dir, get_include_path(),
+                                       msg_template_dict, {'srv.template': '@NAME@.h'}, incremental=True, generator=generator)
+
+        assert (4, 0) == generate({'msg.template': '@NAME@.h'})
+        assert (0, 4) == generate({'msg.template': '@NAME@.h'})
+        # other output file names
+        assert (3, 1) == generate({'msg.template': '@NAME@.hpp'})
+        assert os.path.isfile(os.path.join(output_dir, 'Pose.hpp'))
+        assert os.path.isfile(os.path.join(output_dir, 'GetPoseStampedRequest.hpp'))
+        # changed generator script: files are loaded and rendered again
+        import genmsg.msg_loader
+        load_msg_from_file = genmsg.msg_loader.load_msg_from_file
+        loaded = []
+        def counting_load(*args):
+            loaded.append(args[1])
+            return load_msg_from_file(*args)
+        genmsg.msg_loader.load_msg_from_file = counting_load
+        try:
+            assert (0, 4) == generate({'msg.template': '@NAME@.hpp'})
+            assert [] == loaded
+            with open(generator, 'a') as f:
+                f.write('# v2\n')
+            assert (0, 4) == generate({'msg.template': '@NAME@.hpp'})
+            assert os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg') in loaded
+        finally:
+            genmsg.msg_loader.load_msg_from_file = load_msg_from_file
+    finally:
+        shutil.rmtree(tmp_d)
+
+def test_render_stdout_replaced():
+    import genmsg.template_tools
+    from genmsg.template_tools import _render
+    tmp_d = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        with open(os.path.join(tmp_d, 'a.template'), 'w') as f:
+            f.write('@(x)\n')
+        assert '1\n' == _render(tmp_d, 'a.template', dict(x=1))
+        interpreter = genmsg.template_tools._interpreter
+        assert '2\n' == _render(tmp_d, 'a.template', dict(x=2))
+        assert interpreter is genmsg.template_tools._interpreter
+        # e.g. a test runner capturing output
+        sys.stdout = open(os.devnull, 'w')
+        assert '3\n' == _render(tmp_d, 'a.template', dict(x=3))
+        assert interpreter is not genmsg.template_tools._interpreter
+        interpreter = genmsg.template_tools._interpreter
+        assert '4\n' == _render(tmp_d, 'a.template', dict(x=4))
+        assert interpreter is genmsg.template_tools._interpreter
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tmp_d)
+
+def test_generate_module_files():
+    from genmsg.template_tools import generate_from_files, generate_module, MANIFEST_FILE
+    test_dir = get_test_dir()
+    input_files = [os.path.join(test_dir, 'geometry_msgs', 'msg', 'Pose.msg')]
+    tmp_d = tempfile.mkdtemp()
+    try:
+        template_dir = tmp_d
+        output_dir = os.path.join(tmp_d, 'out')
+        _write_templates(template_dir)
+        with open(os.path.join(template_dir, 'module.template'), 'w') as f:
+            f.write('@(sorted(files))\n')
+        assert (1, 0) == generate_from_files(input_files, 'geometry_msgs', output_dir, template_dir, get_include_path(),
+                                             {'msg.template': '@NAME@.txt'}, {}, incremental=True)
+        assert os.path.isfile(os.path.join(output_dir, MANIFEST_FILE))
+        # stamp of older builds
+        open(os.path.join(output_dir, '.gentest.stamp'), 'w').close()
+        assert (1, 0) == generate_module('geometry_msgs', output_dir, template_dir, {'module.template': '__init__.txt'})
+        with open(os.path.join(output_dir, '__init__.txt')) as f:
+            assert "['Pose.txt']\n" == f.read()
+    finally:
+        shutil.rmtree(tmp_d)